@@ -1,8 +1,11 @@
 import os
 from dotenv import load_dotenv
-from groq import Groq
+from groq import Groq, APIError, APIStatusError, RateLimitError
+import httpx
 import pickle
 import json
+import re
+import threading
 from mdutils.mdutils import MdUtils
 import time
 
@@ -17,6 +20,7 @@ SYSTEM_PROMPT_TRANSLATOR = """
 """
 PRE_PROMPT_EXPRAINER = """
 Please explain the following sentences in detail. Please summarize in bullet points using only * for clarity.
+Output only the bullet points, without any preamble.
 <example>
 **section**
 * point1
@@ -32,18 +36,237 @@ PRE_PROMPT_TRANSLATOR = """
 {}
 </文章>
 """
+SYSTEM_PROMPT_REPAIRER = """
+You are an AI assistant who fixes the format of texts.
+"""
+PRE_PROMPT_REPAIRER = """
+Please rewrite the following text as bullet points using only *. Do not add or drop any information, and keep the language of the text.
+Output only the bullet points, without any preamble.
+<text>
+{}
+</text>
+"""
+
+
+def parse_duration(duration):
+    """
+    ex: "1m2.5s" -> 62.5, "120ms" -> 0.12, "3" -> 3.0
+    """
+    if duration is None:
+        return None
+    try:
+        return float(duration)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"([0-9.]+)(ms|h|m|s)", duration)
+    if len(parts) == 0:
+        return None
+    return sum(float(v) * units[u] for v, u in parts)
+
+
+def split_env(name):
+    """
+    ex: "a, b," -> ["a", "b"]
+    """
+    value = os.environ.get(name, "")
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+class Endpoint:
+    def __init__(self, client, name, model, priority):
+        self.client = client
+        self.name = name
+        self.model = model
+        self.priority = priority
+        self.in_flight = 0
+        self.limit_requests = None
+        self.limit_tokens = None
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.latency = None
+        self.failures = 0
+        self.cooldown_until = 0
+
+    def quota(self):
+        """
+        Fraction of the request and token quota left, whichever is smaller.
+        Unknown quotas count as fully left.
+        """
+        fractions = [1.0]
+        for remaining, limit in [
+            (self.remaining_requests, self.limit_requests),
+            (self.remaining_tokens, self.limit_tokens),
+        ]:
+            if remaining is not None and limit:
+                fractions.append(remaining / limit)
+        return min(fractions)
+
+    def load(self):
+        """
+        Sort key, smaller is better: busy, fallback model, used quota, slow.
+        """
+        latency = 0 if self.latency is None else self.latency
+        return (self.in_flight, self.priority, -self.quota(), latency)
+
+
+class Dispatcher:
+    """
+    Route chat completions to the least-loaded healthy (API key, model) endpoint.
+    Endpoints returning 429 or 5xx are cooled down and the request fails over.
+    Endpoints with an invalid key or model (401, 403, 404) are taken out of the pool.
+    """
+
+    disable_status_codes = (401, 403, 404)
+
+    def __init__(self, api_keys, models):
+        self.lock = threading.Lock()
+        self.endpoints = []
+        for key_num, api_key in enumerate(api_keys):
+            # retries are done by failing over to other endpoints
+            client = Groq(api_key=api_key, max_retries=0)
+            for priority, model in enumerate(models):
+                name = "key{}/{}".format(key_num, model)
+                self.endpoints.append(Endpoint(client, name, model, priority))
+        self.max_attempts = 3 * len(self.endpoints)
+        self.latency_decay = 0.8
+        self.error_cool_sec = 10
+        self.rate_limit_cool_sec = 60
+        self.stats = {"failover": 0}
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if all(e.cooldown_until == float("inf") for e in self.endpoints):
+                    raise RuntimeError("All endpoints are disabled")
+                now = time.time()
+                healthy = [e for e in self.endpoints if e.cooldown_until <= now]
+                if len(healthy) > 0:
+                    endpoint = min(healthy, key=lambda e: e.load())
+                    endpoint.in_flight += 1
+                    return endpoint
+                wait_sec = min(e.cooldown_until for e in self.endpoints) - now
+            print(
+                "\t\tSleep{}[s]: All endpoints are cooling down".format(round(wait_sec))
+            )
+            time.sleep(wait_sec)
+
+    def release(self, endpoint):
+        with self.lock:
+            endpoint.in_flight -= 1
+
+    def update(self, endpoint, headers, latency):
+        with self.lock:
+            for attr, header in [
+                ("limit_requests", "x-ratelimit-limit-requests"),
+                ("limit_tokens", "x-ratelimit-limit-tokens"),
+                ("remaining_requests", "x-ratelimit-remaining-requests"),
+                ("remaining_tokens", "x-ratelimit-remaining-tokens"),
+            ]:
+                value = headers.get(header)
+                if value is not None:
+                    setattr(endpoint, attr, int(value))
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency = (
+                    self.latency_decay * endpoint.latency
+                    + (1 - self.latency_decay) * latency
+                )
+            # do not wait for a 429 if the quota is known to be used up
+            if endpoint.remaining_requests == 0 or endpoint.remaining_tokens == 0:
+                reset = max(
+                    parse_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+                    parse_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+                )
+                endpoint.cooldown_until = time.time() + reset
+
+    def succeed(self, endpoint):
+        """
+        Reset the backoff once a response has been read through.
+        """
+        with self.lock:
+            endpoint.failures = 0
+
+    def is_failover_error(self, error):
+        """
+        Errors on which the request is retried on another endpoint.
+        """
+        if isinstance(error, APIStatusError):
+            return (
+                isinstance(error, RateLimitError)
+                or error.status_code >= 500
+                or error.status_code in self.disable_status_codes
+            )
+        # connection errors, and errors reported or raised while streaming
+        return isinstance(error, (APIError, httpx.TransportError))
+
+    def cool_down(self, endpoint, error):
+        with self.lock:
+            endpoint.failures += 1
+            if (
+                isinstance(error, APIStatusError)
+                and error.status_code in self.disable_status_codes
+            ):
+                cool_sec = float("inf")
+            elif isinstance(error, RateLimitError):
+                cool_sec = parse_duration(error.response.headers.get("retry-after"))
+                cool_sec = self.rate_limit_cool_sec if cool_sec is None else cool_sec
+            else:
+                cool_sec = self.error_cool_sec * 2 ** (endpoint.failures - 1)
+            endpoint.cooldown_until = time.time() + cool_sec
+            self.stats["failover"] += 1
+        if cool_sec == float("inf"):
+            print("Failover: {} ({}), removed from pool".format(endpoint.name, error))
+        else:
+            print(
+                "Failover: {} ({}), cool down {}[s]".format(
+                    endpoint.name, error, cool_sec
+                )
+            )
+
+    def create(self, **params):
+        """
+        Create a chat completion on the least-loaded healthy endpoint.
+
+        Args:
+            params: Parameters of chat.completions.create except model.
+
+        Returns:
+            tuple: Endpoint, to be passed to release() when the response is consumed,
+                and the completion (a stream if stream=True).
+        """
+        error = None
+        for _ in range(self.max_attempts):
+            endpoint = self.acquire()
+            st = time.time()
+            try:
+                raw = endpoint.client.chat.completions.with_raw_response.create(
+                    model=endpoint.model, **params
+                )
+            except (APIError, httpx.TransportError) as e:
+                self.release(endpoint)
+                if not self.is_failover_error(e):
+                    raise
+                self.cool_down(endpoint, e)
+                error = e
+                continue
+            self.update(endpoint, raw.headers, time.time() - st)
+            return endpoint, raw.parse()
+        raise error
 
 
 class LLM:
     def __init__(self):
-        self.client = Groq(api_key=os.environ.get("GROQ_API_KEY"))
         self.system_prompt = {
             "explainer": SYSTEM_PROMPT_EXPRAINER,
             "translator": SYSTEM_PROMPT_TRANSLATOR,
+            "repairer": SYSTEM_PROMPT_REPAIRER,
         }
         self.pre_prompt = {
             "explainer": PRE_PROMPT_EXPRAINER,
             "translator": PRE_PROMPT_TRANSLATOR,
+            "repairer": PRE_PROMPT_REPAIRER,
         }
         self.model_params = {
             "model": "llama3-70b-8192",
@@ -53,7 +276,20 @@ class LLM:
             "max_tokens": 8192,
             "top_p": 0.9,
         }
+        # comma-separated keys and fallback models, the first model is preferred
+        api_keys = split_env("GROQ_API_KEYS") or [os.environ.get("GROQ_API_KEY")]
+        models = split_env("GROQ_MODELS") or [self.model_params["model"]]
+        self.dispatcher = Dispatcher(api_keys, models)
         self.max_redo = 3
+        # abort a streamed response if no bullet line appears within these characters
+        self.early_check_chars = 500
+        self.stats = {
+            "requests": 0,
+            "aborted": 0,
+            "repaired": 0,
+            "redo": 0,
+            "failed": 0,
+        }
 
     def post_process(self, sentence):
         lines = sentence.split("\n")
@@ -67,9 +303,25 @@ class LLM:
         else:
             return "\n".join(lines[start : end + 1])
 
-    def chat(self, sentence, actor, post_proc=False):
-        def run():
-            chat_completion = self.client.chat.completions.create(
+    def has_bullet(self, sentence):
+        return sentence.startswith("*") or "\n*" in sentence
+
+    def stream(self, sentence, actor, validate=False):
+        """
+        Stream a completion, aborting it early if it is off-format.
+
+        Args:
+            sentence: Sentence to be embedded in the actor's pre-prompt.
+            actor: Key of system_prompt and pre_prompt.
+            validate: Abort if no bullet line appears within early_check_chars.
+
+        Returns:
+            tuple: Response text and whether the response was aborted.
+        """
+        self.stats["requests"] += 1
+        params = {k: v for k, v in self.model_params.items() if k != "model"}
+        for attempt in range(self.dispatcher.max_attempts):
+            endpoint, stream = self.dispatcher.create(
                 messages=[
                     {
                         "role": "system",
@@ -80,31 +332,83 @@ class LLM:
                         "content": self.pre_prompt[actor].format(sentence),
                     },
                 ],
-                **self.model_params
+                stream=True,
+                **params,
             )
-            return chat_completion.choices[0].message.content
+            chunks = []
+            checked = not validate
+            try:
+                for chunk in stream:
+                    if len(chunk.choices) == 0:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        chunks.append(content)
+                    if not checked:
+                        res = "".join(chunks)
+                        if self.has_bullet(res):
+                            checked = True
+                        elif len(res) > self.early_check_chars:
+                            stream.close()
+                            self.dispatcher.succeed(endpoint)
+                            self.stats["aborted"] += 1
+                            return res, True
+                self.dispatcher.succeed(endpoint)
+                return "".join(chunks), False
+            except (APIError, httpx.TransportError) as e:
+                # the stream broke off, start over on another endpoint
+                if (attempt == self.dispatcher.max_attempts - 1) or (
+                    not self.dispatcher.is_failover_error(e)
+                ):
+                    raise
+                self.dispatcher.cool_down(endpoint, e)
+            finally:
+                self.dispatcher.release(endpoint)
 
-        res = run()
+    def chat(self, sentence, actor, post_proc=False):
+        # the last attempt is streamed to the end, so a full response is always left
+        validate = post_proc and (self.max_redo > 0)
+        res, aborted = self.stream(sentence, actor, validate=validate)
         if post_proc:
             cnt = 0
+            repair_tried = False
             while True:
-                processed = self.post_process(res)
+                processed = None if aborted else self.post_process(res)
+                if (
+                    (processed is None)
+                    and (not aborted)
+                    and (not repair_tried)
+                    and (res.strip() != "")
+                ):
+                    # reformat the first finished response instead of redoing it
+                    print("Repair: Bad responce.")
+                    repair_tried = True
+                    repaired, repair_aborted = self.stream(
+                        res, actor="repairer", validate=True
+                    )
+                    if not repair_aborted:
+                        processed = self.post_process(repaired)
+                    if processed is not None:
+                        self.stats["repaired"] += 1
                 if (processed is None) and (cnt < self.max_redo):
                     print("Redo: Bad responce.")
-                    res = run()
+                    self.stats["redo"] += 1
                     cnt += 1
+                    validate = cnt < self.max_redo
+                    res, aborted = self.stream(sentence, actor, validate=validate)
                 else:
                     break
             if processed is None:
                 print("No valid responce.")
+                self.stats["failed"] += 1
             else:
                 res = processed
         return res
 
 
 class SummaryWriter:
-    def __init__(self, file_path, llm_cool_sec=0, llm_cool_tokens=12000):
-        self.llm = LLM()
+    def __init__(self, file_path, llm_cool_sec=0, llm_cool_tokens=12000, llm=None):
+        self.llm = LLM() if llm is None else llm
         self.base_path, self.ext = os.path.splitext(file_path)
         self.document = self.read(file_path, self.ext)
         self.llm_cool_sec = llm_cool_sec
@@ -171,8 +475,11 @@ class SummaryWriter:
     def run(self, json_path=None, md_en_path=None, md_jp_path=None):
         title = self.document["title"]
         print("Call assistant for: {}({})".format(self.base_path, title))
+        stats = dict(self.llm.stats)
         contents = self.summary()
-        summary_doc = {"title": title, "contents": contents}
+        llm_stats = {k: v - stats[k] for k, v in self.llm.stats.items()}
+        print("LLM stats: {}".format(llm_stats))
+        summary_doc = {"title": title, "contents": contents, "llm_stats": llm_stats}
         json_path = self.base_path + ".json" if json_path is None else json_path
         self.write_json(summary_doc, json_path)
         md_en_path = (
@@ -187,6 +494,7 @@ class SummaryWriter:
             else md_jp_path
         )
         self.write_md(summary_doc, md_jp_path, "summary_jp")
+        return json_path, md_en_path, md_jp_path
 
 
 def main():
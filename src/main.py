@@ -1,9 +1,9 @@
 import os
 from dotenv import load_dotenv
-import re
 import time
 from pdf_extractor import PdfConverter
 from assistant_groq import SummaryWriter
+from utils import is_summarized
 
 load_dotenv()
 
@@ -31,17 +31,9 @@ def main():
     for pdf_dir in PDF_DIRS:
         file_names = [n for n in os.listdir(pdf_dir)]
         for pdf_name in file_names:
-            base_name, ext = os.path.splitext(pdf_name)
+            _, ext = os.path.splitext(pdf_name)
             if ext == ".pdf":
-                done = False
-                for n in file_names:
-                    pattern = r"^{}.*{}$".format(
-                        re.escape(base_name), re.escape("JP.md")
-                    )
-                    if re.match(pattern, n):
-                        done = True
-                        break
-                if not done:
+                if not is_summarized(pdf_name, file_names):
                     pdf_path = os.path.join(pdf_dir, pdf_name)
                     print("Detect: {}".format(pdf_path))
                     target_pdf_paths.append(pdf_path)
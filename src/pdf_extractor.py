@@ -9,14 +9,18 @@ from utils import parse_args, Formatter
 
 
 class PdfConverter:
-    def __init__(self, pdf_path, format_methods, output_dir=""):
+    def __init__(self, pdf_path, format_methods, output_dir="", stream=None):
         # get args
         self.pdf_path = pdf_path
         self.format_methods = format_methods
         self.output_dir = output_dir
-        # Open PDF
+        # Open PDF (from raw bytes if stream is given, pdf_path is used for naming)
         self.base_path, _ = os.path.splitext(self.pdf_path)
-        with fitz.open(self.pdf_path) as doc:
+        if stream is None:
+            doc = fitz.open(self.pdf_path)
+        else:
+            doc = fitz.open(stream=stream, filetype="pdf")
+        with doc:
             self.metadata = doc.metadata
             self.text_block_pages = self.load_text_block(doc)
             self.toc = doc.get_toc(simple=False)
@@ -361,6 +365,7 @@ class PdfConverter:
         # write markdown
         md_path = save_path + ".md" if md_path is None else md_path
         self.write_md(document, md_path)
+        return json_path, md_path
 
 
 def main():
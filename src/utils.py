@@ -1,4 +1,5 @@
 import argparse
+import os
 import re
 import copy
 
@@ -29,6 +30,22 @@ def parse_args():
     return parser.parse_args()
 
 
+def is_summarized(pdf_name, file_names):
+    """
+    Check whether the Japanese summary of a pdf file already exists.
+
+    Args:
+        pdf_name: File name of the pdf.
+        file_names: File names in the same directory as the pdf.
+
+    Returns:
+        bool: True if a file named like "<pdf base name>...JP.md" exists.
+    """
+    base_name, _ = os.path.splitext(pdf_name)
+    pattern = re.compile(r"^{}.*{}$".format(re.escape(base_name), re.escape("JP.md")))
+    return any(pattern.match(n) for n in file_names)
+
+
 class Formatter:
     def __init__(self):
         self.funcs = {
@@ -0,0 +1,280 @@
+import os
+from dotenv import load_dotenv
+import argparse
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+import time
+from utils import is_summarized
+from worker import JobQueue, Worker
+
+load_dotenv()
+
+# Directories of pdf files
+PDF_DIRS = os.environ.get("PDF_DIRS").split(",")
+
+# a pdf is enqueued once its size and mtime are unchanged for this long
+DEBOUNCE_SEC = 5
+# wait for events (scan interval of the polling fallback) while nothing is pending
+POLL_SEC = 10
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def list_pdfs(pdf_dir):
+    return [
+        os.path.join(pdf_dir, n)
+        for n in os.listdir(pdf_dir)
+        if os.path.splitext(n)[1].lower() == ".pdf"
+    ]
+
+
+class InotifyWatcher:
+    """
+    Report changed files in directories using Linux inotify.
+    lost becomes True when a watched directory is removed, moved or unmounted.
+    """
+
+    def __init__(self, pdf_dirs):
+        self.pdf_dirs = pdf_dirs
+        self.lost = False
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wds = {}
+        mask = (
+            IN_MODIFY
+            | IN_CLOSE_WRITE
+            | IN_MOVED_TO
+            | IN_CREATE
+            | IN_DELETE_SELF
+            | IN_MOVE_SELF
+        )
+        for pdf_dir in pdf_dirs:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(pdf_dir), mask)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed", pdf_dir)
+            self.wds[wd] = pdf_dir
+
+    def events(self, timeout, stopped):
+        """
+        Wait for changes up to timeout seconds, or until stopped is set.
+
+        Returns:
+            list: Paths of changed files.
+        """
+        end = time.time() + timeout
+        while True:
+            # wake up every second to notice stopped
+            wait_sec = min(end - time.time(), 1)
+            if wait_sec <= 0 or stopped.is_set():
+                return []
+            readable, _, _ = select.select([self.fd], [], [], wait_sec)
+            if readable:
+                break
+        paths = []
+        while True:
+            try:
+                buf = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = INOTIFY_EVENT.unpack_from(buf, offset)
+                offset += INOTIFY_EVENT.size
+                name = buf[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_UNMOUNT | IN_IGNORED):
+                    if not self.lost:
+                        print("Lost watch: {}".format(self.wds.get(wd)))
+                    self.lost = True
+                elif mask & IN_Q_OVERFLOW:
+                    # events are lost, treat every pdf as changed
+                    for pdf_dir in self.pdf_dirs:
+                        paths += list_pdfs(pdf_dir)
+                elif wd in self.wds and name:
+                    paths.append(os.path.join(self.wds[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """
+    Report changed pdf files in directories by comparing size and mtime snapshots.
+    """
+
+    def __init__(self, pdf_dirs):
+        self.pdf_dirs = pdf_dirs
+        self.lost = False
+        self.snapshot = self.scan()
+
+    def scan(self):
+        snapshot = {}
+        for pdf_dir in self.pdf_dirs:
+            try:
+                pdf_paths = list_pdfs(pdf_dir)
+            except FileNotFoundError:
+                # removed directories are picked up again once they come back
+                continue
+            for pdf_path in pdf_paths:
+                try:
+                    st = os.stat(pdf_path)
+                except FileNotFoundError:
+                    continue
+                snapshot[pdf_path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def events(self, timeout, stopped):
+        if stopped.wait(timeout):
+            return []
+        snapshot = self.scan()
+        paths = [p for p, v in snapshot.items() if self.snapshot.get(p) != v]
+        self.snapshot = snapshot
+        return paths
+
+    def close(self):
+        pass
+
+
+class PdfWatcher:
+    """
+    Watch pdf directories and enqueue new or modified pdf files once fully written.
+    Modified pdf files are summarized again even if summaries already exist.
+    """
+
+    def __init__(
+        self,
+        queue,
+        pdf_dirs,
+        format_methods="",
+        worker=None,
+        debounce_sec=DEBOUNCE_SEC,
+        polling=False,
+    ):
+        self.queue = queue
+        self.pdf_dirs = pdf_dirs
+        self.format_methods = format_methods
+        self.worker = worker
+        self.debounce_sec = debounce_sec
+        # path -> ((size, mtime), time of the last change)
+        self.pending = {}
+        self.watcher = None
+        if not polling:
+            try:
+                self.watcher = InotifyWatcher(pdf_dirs)
+            except (OSError, AttributeError) as e:
+                print("inotify is not available, fall back to polling: {}".format(e))
+        if self.watcher is None:
+            self.watcher = PollingWatcher(pdf_dirs)
+
+    def enqueue(self, pdf_path):
+        if self.queue.is_pending(pdf_path):
+            return
+        print("Detect: {}".format(pdf_path))
+        self.queue.submit(pdf_path, format_methods=self.format_methods)
+        if self.worker is not None:
+            self.worker.notify()
+
+    def flush(self):
+        now = time.time()
+        for pdf_path, (signature, changed_at) in list(self.pending.items()):
+            try:
+                st = os.stat(pdf_path)
+            except FileNotFoundError:
+                del self.pending[pdf_path]
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != signature:
+                self.pending[pdf_path] = (current, now)
+            elif (now - changed_at >= self.debounce_sec) and (st.st_size > 0):
+                del self.pending[pdf_path]
+                self.enqueue(pdf_path)
+
+    def run(self, stopped=None):
+        stopped = threading.Event() if stopped is None else stopped
+        # pick up pdf files not summarized yet, debounced like changed files
+        for pdf_dir in self.pdf_dirs:
+            file_names = os.listdir(pdf_dir)
+            for pdf_path in list_pdfs(pdf_dir):
+                if not is_summarized(os.path.basename(pdf_path), file_names):
+                    self.pending[pdf_path] = (None, time.time())
+        print("Watch: {}".format(", ".join(self.pdf_dirs)))
+        try:
+            while not stopped.is_set():
+                timeout = self.debounce_sec / 2 if self.pending else POLL_SEC
+                for path in self.watcher.events(timeout, stopped):
+                    if os.path.splitext(path)[1].lower() == ".pdf":
+                        self.pending[path] = (None, time.time())
+                if self.watcher.lost:
+                    print("Fall back to polling: {}".format(", ".join(self.pdf_dirs)))
+                    self.watcher.close()
+                    self.watcher = PollingWatcher(self.pdf_dirs)
+                self.flush()
+        finally:
+            self.watcher.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM paper assistant watcher")
+    parser.add_argument(
+        "--db", type=str, default="data/jobs.sqlite3", help="SQLite job queue path"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default="",
+        help="Comma-separated format methods, e.g.: del_break,neurips_preprint.",
+    )
+    parser.add_argument(
+        "--polling", action="store_true", help="Poll directories instead of inotify"
+    )
+    parser.add_argument(
+        "--no-worker",
+        action="store_true",
+        help="Only enqueue jobs, for a worker running in another process",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    queue = JobQueue(args.db)
+    worker = None
+    if not args.no_worker:
+        worker = Worker(queue)
+        threading.Thread(target=worker.run, daemon=True).start()
+    watcher = PdfWatcher(
+        queue,
+        PDF_DIRS,
+        format_methods=args.format,
+        worker=worker,
+        polling=args.polling,
+    )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if worker is not None:
+            worker.stop()
+
+
+if __name__ == "__main__":
+    main()
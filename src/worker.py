@@ -0,0 +1,356 @@
+import os
+from dotenv import load_dotenv
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from pdf_extractor import PdfConverter
+from assistant_groq import LLM, SummaryWriter
+from utils import Formatter
+
+load_dotenv()
+
+# sleep time for rate limits
+# https://console.groq.com/settings/limits
+SLEEP_FOR_RATE_LIMITS = 60
+LLM_COOL_SEC = 30
+LLM_COOL_TOKENS = 6000
+# interval to look for jobs submitted directly to the database by other processes
+POLL_SEC = 5
+
+
+class JobQueue:
+    """
+    SQLite backed job queue shared by the HTTP API, the worker and other processes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    status TEXT NOT NULL,
+                    pdf_path TEXT NOT NULL,
+                    pdf_bytes BLOB,
+                    output_dir TEXT NOT NULL,
+                    format_methods TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+
+    def recover(self):
+        """
+        Queue again the jobs left running by a previous worker shutdown.
+        Only the worker calls this at startup, other processes share the queue.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued' WHERE status = 'running'"
+            )
+
+    def submit(self, pdf_path, output_dir="", format_methods="", pdf_bytes=None):
+        """
+        Add a job to the queue.
+
+        Args:
+            pdf_path: Path of the PDF file, only used for naming if pdf_bytes is given.
+            output_dir: Output directory, same as PdfConverter.
+            format_methods: Comma-separated format methods, same as PdfConverter.
+            pdf_bytes: Raw PDF data.
+
+        Returns:
+            int: Job id.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO jobs (status, pdf_path, pdf_bytes, output_dir,"
+                " format_methods, created_at, updated_at)"
+                " VALUES ('queued', ?, ?, ?, ?, ?, ?)",
+                (pdf_path, pdf_bytes, output_dir, format_methods, now, now),
+            )
+        return cur.lastrowid
+
+    def claim(self):
+        """
+        Mark the oldest queued job as running and return it (None if nothing is queued).
+        """
+        with self.lock, self.conn:
+            # lock the database before reading so other processes cannot claim the job
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), row["id"]),
+            )
+        return dict(row)
+
+    def finish(self, job_id, result=None, error=None):
+        status = "failed" if error is not None else "done"
+        result = json.dumps(result, ensure_ascii=False) if result is not None else None
+        with self.lock, self.conn:
+            # raw PDF data is no longer needed once the job is finished
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, pdf_bytes = NULL,"
+                " updated_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id, status, pdf_path, output_dir, format_methods, result,"
+                " error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def is_pending(self, pdf_path):
+        """
+        Check whether a job not started yet exists for the pdf file.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM jobs WHERE pdf_path = ? AND status = 'queued' LIMIT 1",
+                (pdf_path,),
+            ).fetchone()
+        return row is not None
+
+    def list(self, status=None):
+        with self.lock:
+            if status is None:
+                rows = self.conn.execute(
+                    "SELECT id, status, pdf_path, updated_at FROM jobs ORDER BY id"
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT id, status, pdf_path, updated_at FROM jobs"
+                    " WHERE status = ? ORDER BY id",
+                    (status,),
+                ).fetchall()
+        return [dict(r) for r in rows]
+
+
+class Worker:
+    """
+    Process queued jobs one by one, keeping a single LLM client and its pool warm.
+    """
+
+    def __init__(
+        self, queue, llm_cool_sec=LLM_COOL_SEC, llm_cool_tokens=LLM_COOL_TOKENS
+    ):
+        self.queue = queue
+        self.llm = LLM()
+        self.llm_cool_sec = llm_cool_sec
+        self.llm_cool_tokens = llm_cool_tokens
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def process(self, job):
+        json_path, md_path = PdfConverter(
+            job["pdf_path"],
+            job["format_methods"],
+            output_dir=job["output_dir"],
+            stream=job["pdf_bytes"],
+        ).run()
+        json_path, md_en_path, md_jp_path = SummaryWriter(
+            json_path,
+            llm_cool_sec=self.llm_cool_sec,
+            llm_cool_tokens=self.llm_cool_tokens,
+            llm=self.llm,
+        ).run()
+        return {
+            "json": json_path,
+            "md": md_path,
+            "md_en": md_en_path,
+            "md_jp": md_jp_path,
+        }
+
+    def run(self):
+        recovered = False
+        last_finished = None
+        while not self.stopped.is_set():
+            # wait before claiming, so queued jobs do not show running while sleeping
+            if last_finished is not None:
+                sleep_sec = SLEEP_FOR_RATE_LIMITS - (time.time() - last_finished)
+                if sleep_sec > 0:
+                    print("sleep {}[s] for rate limits".format(round(sleep_sec)))
+                    self.stopped.wait(sleep_sec)
+                    continue
+            try:
+                if not recovered:
+                    self.queue.recover()
+                    recovered = True
+                job = self.queue.claim()
+            except sqlite3.OperationalError as e:
+                # e.g. database is locked by another process, retry on the next poll
+                print(e)
+                job = None
+            if job is None:
+                self.wakeup.wait(POLL_SEC)
+                self.wakeup.clear()
+                continue
+            st = time.time()
+            header = "{} job {}: {} {}".format(
+                "=" * 5, job["id"], job["pdf_path"], "=" * 5
+            )
+            print(header)
+            try:
+                result = self.process(job)
+                self.queue.finish(job["id"], result=result)
+            except Exception as e:
+                print(e)
+                self.queue.finish(job["id"], error=str(e))
+            print("- {}[s] -\n{}\n".format(round(time.time() - st), "=" * len(header)))
+            last_finished = time.time()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    Local HTTP API.
+
+    POST /jobs                      {"pdf": path, "output": dir, "format": methods}
+    POST /jobs?name=x.pdf&output=.  Raw PDF body (Content-Type: application/pdf)
+    GET  /jobs[?status=queued]      List jobs
+    GET  /jobs/<id>                 Job status and result
+    """
+
+    queue = None
+    worker = None
+
+    def send_json(self, code, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p != ""]
+        if parts == ["jobs"]:
+            status = parse_qs(url.query).get("status", [None])[0]
+            self.send_json(200, self.queue.list(status))
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1].isdigit():
+            job = self.queue.get(int(parts[1]))
+            if job is None:
+                self.send_json(404, {"error": "job not found"})
+            else:
+                self.send_json(200, job)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            self.send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.send_json(400, {"error": "invalid Content-Length"})
+            return
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/pdf"):
+            query = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if "name" not in query:
+                self.send_json(400, {"error": "name is required for raw PDF"})
+                return
+            output_dir = query.get("output", "")
+            pdf_path = os.path.join(output_dir, os.path.basename(query["name"]))
+            pdf_bytes = body
+        else:
+            try:
+                query = json.loads(body)
+            except ValueError:
+                self.send_json(400, {"error": "invalid JSON"})
+                return
+            pdf_path = query.get("pdf") if isinstance(query, dict) else None
+            if not isinstance(pdf_path, str) or not os.path.isfile(pdf_path):
+                self.send_json(400, {"error": "pdf must be an existing file"})
+                return
+            output_dir = query.get("output", "")
+            pdf_bytes = None
+        format_methods = query.get("format", "")
+        if not isinstance(output_dir, str) or not (
+            output_dir == "" or os.path.isdir(output_dir)
+        ):
+            self.send_json(400, {"error": "output must be an existing directory"})
+            return
+        if not isinstance(format_methods, str) or any(
+            name not in Formatter().funcs for name in format_methods.split(",") if name
+        ):
+            self.send_json(400, {"error": "format must be comma-separated methods"})
+            return
+        job_id = self.queue.submit(
+            pdf_path,
+            output_dir=output_dir,
+            format_methods=format_methods,
+            pdf_bytes=pdf_bytes,
+        )
+        self.worker.notify()
+        self.send_json(202, {"id": job_id, "status": "queued"})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="LLM paper assistant worker")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address")
+    parser.add_argument("--port", type=int, default=8765, help="Bind port")
+    parser.add_argument(
+        "--db", type=str, default="data/jobs.sqlite3", help="SQLite job queue path"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    queue = JobQueue(args.db)
+    worker = Worker(queue)
+    JobRequestHandler.queue = queue
+    JobRequestHandler.worker = worker
+    server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    print("Listen: http://{}:{}/jobs".format(args.host, args.port))
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()